@@ -3,13 +3,12 @@
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 import pandas as pd
 from datetime import datetime, timedelta
 import time
 from unidecode import unidecode
+import page_state
 
 # Funcao para converter preco de texto para float
 def convert_price(price_text):
@@ -57,6 +56,18 @@ city_pairs = [
     ("Sao Paulo - SP", "Brasilia - DF")
 ]
 
+# Condicoes da pagina de busca: resultados, aviso de "sem viagens", bloqueio ou erro
+# (container de resultados: ajustar conforme inspecao)
+search_conditions = page_state.search_conditions(
+    "app-trip",
+    "app-search-result, app-trip-list, app-trips",
+    ["nenhuma viagem", "nao encontramos", "não encontramos", "sem viagens disponiveis", "sem viagens disponíveis"],
+    ["app-empty-trips", ".empty-state"]
+)
+
+# Estado observado de cada busca (rota/data), salvo junto com os dados
+task_outcomes = []
+
 # Funcao para obter slugs das cidades a partir dos nomes
 def get_city_slugs(origin_name, destination_name):
     # Gerar slugs diretamente dos nomes das cidades
@@ -94,31 +105,48 @@ def test_city_combinations(driver, origin_base, destination_base, departure_date
         print(f"Acessando URL: {url}")
         driver.get(url)
 
+        outcome = {"etapa": "combinacao", "origem": origin_slug, "destino": destination_slug,
+                   "data_consulta": departure_date, "estado": page_state.TIMEOUT, "viagens": 0}
+        task_outcomes.append(outcome)
+
         try:
-            WebDriverWait(driver, 20).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "app-trip"))
-            )
-            trips = driver.find_elements(By.CSS_SELECTOR, "app-trip")
-            if trips:
+            outcome["estado"] = page_state.wait_for_page_state(driver, search_conditions, 20)
+            if outcome["estado"] == page_state.RESULTS:
+                trips = driver.find_elements(By.CSS_SELECTOR, "app-trip")
+                outcome["viagens"] = len(trips)
                 print(f"Combinacao bem-sucedida! Encontradas {len(trips)} viagens.")
                 return origin_slug, destination_slug
-            else:
-                print("Nenhuma viagem encontrada para esta combinacao.")
+            if outcome["estado"] == page_state.BLOCKED:
+                print("A pagina parece estar bloqueada por CAPTCHA ou anti-scraping. Intervencao manual necessaria.")
+                break
+            print(f"Nenhuma viagem encontrada para esta combinacao (estado: {outcome['estado']}).")
         except Exception as e:
             print(f"Erro ao testar combinacao: {e}")
+            outcome["estado"] = page_state.ERROR
             continue
 
     print("Nenhuma combinacao valida encontrada para as cidades fornecidas.")
     return None, None
 
+# Condicoes do mapa de assentos de uma viagem; os textos de erro so sao procurados no
+# mapa de assentos / alerta, nao no card inteiro (ajustar seletores conforme inspecao)
+seat_map_conditions = [
+    page_state.condition(page_state.RESULTS, [".vehicle-item"]),
+    page_state.condition(page_state.ERROR, [".alert-danger", ".error-message"],
+                         ["indisponivel", "indisponível", "tente novamente", "erro ao carregar"],
+                         visible=page_state.RENDERED, text_root="app-vehicle, .seat-map, .alert, .error-message"),
+]
+
 # Funcao para extrair ocupacao apos clique
 def get_occupancy(trip_id, driver):
     try:
         print(f"Clicando para exibir ocupacao da viagem {trip_id}...")
         driver.find_element(By.CSS_SELECTOR, f"#{trip_id} [data-testid='selectTripAction']").click()
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, f"#{trip_id} .vehicle-item"))
-        )
+        # Corrida entre o mapa de assentos e um aviso de erro dentro da propria viagem
+        state = page_state.wait_for_page_state(driver, seat_map_conditions, 10, root_selector=f"#{trip_id}")
+        if state != page_state.RESULTS:
+            print(f"Mapa de assentos indisponivel para {trip_id} (estado: {state}).")
+            return None, None, None
 
         seats = driver.find_elements(By.CSS_SELECTOR, f"#{trip_id} .vehicle-item")
         total_seats = 0
@@ -149,21 +177,29 @@ def scrape_guanabara_trips(origin_slug, origin_name, destination_slug, destinati
     print(f"Acessando URL: {url}")
     driver.get(url)
 
+    outcome = {"etapa": "coleta", "origem": origin_name, "destino": destination_name, "data_consulta": departure_date,
+               "Coletado_dia": collect_date, "estado": page_state.TIMEOUT, "viagens": 0}
+    task_outcomes.append(outcome)
+
     try:
-        WebDriverWait(driver, 60).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "app-trip"))
-        )
+        outcome["estado"] = page_state.wait_for_page_state(driver, search_conditions, 60)
     except Exception as e:
         print(f"Erro ao carregar a pagina: {e}")
+        outcome["estado"] = page_state.ERROR
         return []
 
-    if "CAPTCHA" in driver.page_source or "bloqueado" in driver.page_source.lower():
+    if outcome["estado"] == page_state.BLOCKED:
         print("A pagina parece estar bloqueada por CAPTCHA ou anti-scraping. Intervencao manual necessaria.")
         return []
+    if outcome["estado"] != page_state.RESULTS:
+        print(f"Nenhuma viagem encontrada na pagina (estado: {outcome['estado']}).")
+        return []
 
     trips = driver.find_elements(By.CSS_SELECTOR, "app-trip")
+    outcome["viagens"] = len(trips)
     if not trips:
         print("Nenhuma viagem encontrada na pagina.")
+        outcome["estado"] = page_state.EMPTY
         return []
 
     print(f"Encontradas {len(trips)} viagens na pagina.")
@@ -278,11 +314,21 @@ for entry in all_data:
         if isinstance(value, str):
             entry[key] = unidecode(value)
 
-# Salvar em XLSX
+# Salvar em XLSX (dados das viagens + estado de cada busca)
+df_outcomes = pd.DataFrame(task_outcomes)
+if not df_outcomes.empty:
+    print("\nResumo dos estados das buscas:")
+    print(df_outcomes["estado"].value_counts())
+
+if all_data or not df_outcomes.empty:
+    # Os estados das buscas sao salvos mesmo sem nenhuma viagem (rotas vazias, bloqueio, timeout)
+    with pd.ExcelWriter("guanabara_trips_data.xlsx", engine='openpyxl') as writer:
+        pd.DataFrame(all_data).to_excel(writer, sheet_name="viagens", index=False)
+        df_outcomes.to_excel(writer, sheet_name="buscas", index=False)
+
 if all_data:
     df = pd.DataFrame(all_data)
-    df.to_excel("guanabara_trips_data.xlsx", index=False, engine='openpyxl')
     print("\nDados coletados e salvos em guanabara_trips_data.xlsx:")
     print(df)
 else:
-    print("\nNenhum dado foi coletado. Verifique os logs acima para identificar o problema.")
+    print("\nNenhum dado foi coletado. Verifique os logs acima e a aba 'buscas' de guanabara_trips_data.xlsx.")
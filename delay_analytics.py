@@ -0,0 +1,154 @@
+import csv
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Default location of the line -> business partner catalog
+lines_bp_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "LINES&BP.csv")
+
+# Delays are kept in 1-minute buckets; anything above max_delay_minutes shares the last bucket
+max_delay_minutes = 360
+
+def load_line_partners(path=lines_bp_path):
+    """Load LINES&BP.csv into a {line_code: (partner, line_name)} lookup."""
+    lookup = {}
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                code = (row.get("LINE") or "").strip().upper()
+                if code:
+                    lookup[code] = ((row.get("BP") or "Unknown").strip(), (row.get("LINE NAME") or "").strip())
+    except OSError as e:
+        print(f"Could not read line/partner catalog {path}: {e}")
+    return lookup
+
+def _timestamp_to_epoch(timestamp_str):
+    """Parse an API timestamp to epoch seconds, treating it as UTC like format_time does; None if invalid."""
+    try:
+        dt = datetime.fromisoformat(timestamp_str[:19])
+    except (TypeError, ValueError):
+        return None
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+class _WindowStats:
+    """Histogram of delays for one line, partner or station inside the rolling window."""
+
+    __slots__ = ("count", "on_time", "buckets", "summary")
+
+    def __init__(self):
+        self.count = 0
+        self.on_time = 0
+        self.buckets = [0] * (max_delay_minutes + 1)
+        self.summary = None
+
+    def add(self, bucket, on_time, sign):
+        self.count += sign
+        self.on_time += sign if on_time else 0
+        self.buckets[bucket] += sign
+        self.summary = None
+
+    def percentile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+        for minutes, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return minutes
+        return max_delay_minutes
+
+    def snapshot(self):
+        # Cached until the next add(), so repeated dashboard reads are O(1)
+        if self.summary is None:
+            self.summary = {
+                "count": self.count,
+                "p50_delay_minutes": self.percentile(0.5) if self.count else None,
+                "p95_delay_minutes": self.percentile(0.95) if self.count else None,
+                "on_time_ratio": self.on_time / self.count if self.count else None,
+            }
+        return self.summary
+
+class DelayAnalytics:
+    """Rolling-window delay statistics per line, business partner and station, updated per poll."""
+
+    dimensions = ("line", "partner", "station")
+
+    def __init__(self, window_seconds=24 * 3600, line_partners=None, on_time_threshold_seconds=0):
+        self.window_seconds = window_seconds
+        self.on_time_threshold_seconds = on_time_threshold_seconds
+        self.line_partners = load_line_partners() if line_partners is None else line_partners
+        # ride_id -> (observed_at, keys, bucket, on_time), ordered by last observation
+        self._rides = OrderedDict()
+        self._stats = {dimension: {} for dimension in self.dimensions}
+        self._lock = threading.Lock()
+
+    def partner_for(self, line_code):
+        """Return the business partner for a line code, or 'Unknown'."""
+        entry = self.line_partners.get((line_code or "").upper())
+        return entry[0] if entry else "Unknown"
+
+    def record(self, ride, station, observed_at=None):
+        """Add or refresh one ride from a departures API response; returns False if the ride was skipped."""
+        ride_id = ride.get("id")
+        if not ride_id:
+            return False
+        observed_at = time.time() if observed_at is None else observed_at
+        status = ride.get("status") or {}
+        line_code = (ride.get("line") or {}).get("code") or "Unknown"
+        deviation = status.get("deviation") or {}
+        if not deviation:
+            # The daily query also returns rides that have not left yet; without a deviation
+            # they would count as on time with 0 delay, so wait until the scheduled departure
+            scheduled_at = _timestamp_to_epoch(status.get("scheduled_timestamp"))
+            if scheduled_at is None or scheduled_at > observed_at:
+                return False
+        delay_seconds = max(0, deviation.get("deviation_seconds") or 0)
+        on_time = deviation.get("deviation_class") != "LATE" or delay_seconds <= self.on_time_threshold_seconds
+        bucket = min(int(delay_seconds // 60), max_delay_minutes)
+        keys = (line_code, self.partner_for(line_code), station)
+
+        with self._lock:
+            # A ride is seen again on every poll: replace its previous contribution
+            previous = self._rides.pop(ride_id, None)
+            if previous is not None:
+                self._apply(previous[1], previous[2], previous[3], -1)
+            self._rides[ride_id] = (observed_at, keys, bucket, on_time)
+            self._apply(keys, bucket, on_time, 1)
+            self._expire(observed_at)
+        return True
+
+    def _apply(self, keys, bucket, on_time, sign):
+        for dimension, key in zip(self.dimensions, keys):
+            stats = self._stats[dimension].get(key)
+            if stats is None:
+                stats = self._stats[dimension][key] = _WindowStats()
+            stats.add(bucket, on_time, sign)
+
+    def _expire(self, now):
+        cutoff = now - self.window_seconds
+        while self._rides:
+            ride_id, (observed_at, keys, bucket, on_time) = next(iter(self._rides.items()))
+            if observed_at >= cutoff:
+                break
+            del self._rides[ride_id]
+            self._apply(keys, bucket, on_time, -1)
+            for dimension, key in zip(self.dimensions, keys):
+                if self._stats[dimension][key].count == 0:
+                    del self._stats[dimension][key]
+
+    def expire(self, now=None):
+        """Drop rides that fell out of the window (call between polls if no rides arrive)."""
+        with self._lock:
+            self._expire(time.time() if now is None else now)
+
+    def stats(self, dimension, key):
+        """Return count, p50/p95 delay (minutes) and on-time ratio for one line, partner or station."""
+        with self._lock:
+            stats = self._stats[dimension].get(key)
+            return dict(stats.snapshot()) if stats and stats.count else None
+
+    def summary(self, dimension):
+        """Return {key: stats} for every line, partner or station currently in the window."""
+        with self._lock:
+            return {key: dict(stats.snapshot()) for key, stats in self._stats[dimension].items() if stats.count}
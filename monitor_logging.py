@@ -0,0 +1,150 @@
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime, timezone
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        category = getattr(record, "category", None)
+        if category:
+            entry["category"] = category
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+_traceback_formatter = logging.Formatter()
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the traceback in exc_text instead of folding it into the message."""
+
+    def prepare(self, record):
+        # The default prepare() formats the traceback into msg and clears exc_info, so the
+        # listener's formatters can no longer tell message and exception apart
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _traceback_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+class PayloadSamplingFilter(logging.Filter):
+    """Keep 1 in N records that carry a payload, with N configured per category."""
+
+    def __init__(self, sample_every):
+        super().__init__()
+        self.sample_every = sample_every
+        self._counters = {}
+
+    def filter(self, record):
+        if getattr(record, "payload", None) is None:
+            return False
+        category = getattr(record, "category", None) or "default"
+        every = self.sample_every.get(category, 1)
+        if every <= 0:
+            return False
+        seen = self._counters.get(category, 0)
+        self._counters[category] = seen + 1
+        return seen % every == 0
+
+class GzipArchiveHandler(logging.Handler):
+    """Append raw payloads as JSON lines to a gzip file per day (raw-YYYY-MM-DD.jsonl.gz)."""
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._day = None
+        self._stream = None
+
+    def _open_for(self, day):
+        if self._stream is not None:
+            self._stream.close()
+        path = os.path.join(self.directory, f"raw-{day}.jsonl.gz")
+        # Appending creates a new gzip member; readers see one continuous file
+        self._stream = gzip.open(path, "at", encoding="utf-8", compresslevel=6)
+        self._day = day
+
+    def emit(self, record):
+        try:
+            day = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d")
+            if day != self._day:
+                self._open_for(day)
+            entry = {
+                "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+                "category": getattr(record, "category", None),
+                "msg": record.getMessage(),
+                "payload": record.payload,
+            }
+            self._stream.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+        finally:
+            self.release()
+        super().close()
+
+def setup_logging(log_file, level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5,
+                  rotate_when=None, raw_archive_dir=None, sample_every=None):
+    """Route the root logger through a queue so handlers (disk, console, archive) run on a background thread.
+
+    File records are JSON lines, rotated by size (max_bytes) or, if rotate_when is set
+    (e.g. "midnight"), by time. Records logged with extra={"payload": ..., "category": ...}
+    are additionally written to a gzip archive in raw_archive_dir, sampled per category
+    by sample_every ({category: N} keeps 1 in N).
+    """
+    if rotate_when:
+        file_handler = logging.handlers.TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count, encoding="utf-8")
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    handlers = [file_handler, console_handler]
+    if raw_archive_dir:
+        archive_handler = GzipArchiveHandler(raw_archive_dir)
+        archive_handler.addFilter(PayloadSamplingFilter(sample_every or {}))
+        handlers.append(archive_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    def _shutdown():
+        listener.stop()
+        for handler in handlers:
+            handler.close()
+
+    atexit.register(_shutdown)
+    return listener
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Classificador de estado de pagina para os crawlers Selenium.
+# Em vez de esperar o timeout inteiro por um unico seletor (ex.: "app-trip" ou
+# "cardResultado"), testa varias condicoes ao mesmo tempo (resultados, aviso de
+# "sem viagens", CAPTCHA/bloqueio, pagina de erro) e retorna assim que qualquer
+# uma aparece. Cada teste e feito com um unico execute_script por polling.
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Estados possiveis retornados pelo classificador
+RESULTS = "resultados"
+EMPTY = "sem_viagens"
+BLOCKED = "bloqueado"
+ERROR = "erro"
+TIMEOUT = "timeout"
+
+# Exigencia de visibilidade dos seletores de uma condicao
+RENDERED = "rendered"    # renderizado na pagina (pode estar abaixo da dobra)
+ON_SCREEN = "on_screen"  # renderizado e dentro da area visivel da janela
+
+# Marcadores de bloqueio: somente desafios que cobrem a pagina (janela de desafio do
+# reCAPTCHA/hCaptcha, interstitial do Cloudflare) e frases de pagina de bloqueio.
+# reCAPTCHA invisivel embutido em paginas normais (badge, iframe anchor) nao conta.
+BLOCKED_SELECTORS = ["iframe[src*='recaptcha/api2/bframe']", "iframe[src*='recaptcha/enterprise/bframe']",
+                     "iframe[src*='hcaptcha.com'][src*='frame=challenge']",
+                     "#challenge-form", "#challenge-stage", "#cf-challenge-running"]
+BLOCKED_TEXTS = ["access denied", "acesso negado", "you have been blocked", "você foi bloqueado", "voce foi bloqueado"]
+# Marcadores de pagina de erro (ajustar conforme inspecao)
+ERROR_SELECTORS = [".error-page", "app-error", "app-not-found"]
+ERROR_TEXTS = ["algo deu errado", "pagina nao encontrada", "página não encontrada",
+               "erro interno", "service unavailable", "502 bad gateway", "504 gateway"]
+# Frases de bloqueio/erro so sao procuradas no titulo principal ou em containers de erro,
+# nunca no corpo inteiro (FAQ, rodape e widgets de ajuda repetem essas frases)
+PAGE_MESSAGE_ROOT = ".error-page, .error-container, app-error, app-not-found, h1"
+
+# Script que avalia as condicoes em ordem e retorna o primeiro estado observado.
+# arguments[0]: lista de [estado, seletores, textos, visibilidade, raiz_do_texto];
+# arguments[1]: seletor raiz opcional
+_CLASSIFY_JS = """
+var conditions = arguments[0];
+var root = arguments[1] ? document.querySelector(arguments[1]) : document;
+if (!root) { return null; }
+function isRendered(el) {
+    if (!el.getClientRects().length) { return false; }
+    var style = window.getComputedStyle(el);
+    return style.display !== 'none' && style.visibility !== 'hidden';
+}
+function isOnScreen(el) {
+    var rect = el.getBoundingClientRect();
+    if (rect.width < 2 || rect.height < 2) { return false; }
+    if (rect.bottom <= 0 || rect.right <= 0 || rect.top >= window.innerHeight || rect.left >= window.innerWidth) { return false; }
+    return isRendered(el) && parseFloat(window.getComputedStyle(el).opacity || '1') > 0;
+}
+var textsByRoot = {};
+function textOf(textRoot) {
+    var key = textRoot || '';
+    if (!(key in textsByRoot)) {
+        var el = textRoot ? root.querySelector(textRoot) : (root === document ? document.body : root);
+        textsByRoot[key] = el ? (el.innerText || '').toLowerCase() : null;
+    }
+    return textsByRoot[key];
+}
+for (var i = 0; i < conditions.length; i++) {
+    var state = conditions[i][0], selectors = conditions[i][1], texts = conditions[i][2];
+    var visibility = conditions[i][3], textRoot = conditions[i][4];
+    for (var j = 0; j < selectors.length; j++) {
+        if (visibility) {
+            var check = visibility === 'on_screen' ? isOnScreen : isRendered;
+            var found = root.querySelectorAll(selectors[j]);
+            for (var v = 0; v < found.length; v++) {
+                if (check(found[v])) { return state; }
+            }
+        } else if (root.querySelector(selectors[j])) {
+            return state;
+        }
+    }
+    if (texts.length) {
+        var text = textOf(textRoot);
+        if (text === null) { continue; }
+        for (var k = 0; k < texts.length; k++) {
+            if (text.indexOf(texts[k]) !== -1) { return state; }
+        }
+    }
+}
+return null;
+"""
+
+# Funcao para montar uma condicao: estado + seletores CSS + trechos de texto (case-insensitive).
+# visible: None (basta existir no DOM), RENDERED ou ON_SCREEN.
+# text_root: seletor do elemento onde os textos sao procurados (None = pagina/raiz inteira);
+# se o elemento ainda nao existir, os textos nao sao testados.
+def condition(state, selectors=(), texts=(), visible=None, text_root=None):
+    return [state, list(selectors), [t.lower() for t in texts], visible, text_root]
+
+# Funcao para montar a lista padrao de condicoes de uma pagina de busca.
+# Resultados vem primeiro: se ha viagens na tela, a pagina nunca e descartada como bloqueio/vazia.
+# Os textos de "sem viagens" so sao procurados dentro do container de resultados, para que
+# textos fixos da pagina nao encerrem a espera antes de os resultados renderizarem.
+def search_conditions(results_selector, results_container, empty_texts, empty_selectors=()):
+    return [
+        condition(RESULTS, [results_selector]),
+        # Desafios de bloqueio cobrem a tela; o aviso de "sem viagens" pode estar abaixo da dobra
+        condition(BLOCKED, BLOCKED_SELECTORS, BLOCKED_TEXTS, visible=ON_SCREEN, text_root=PAGE_MESSAGE_ROOT),
+        condition(EMPTY, empty_selectors, empty_texts, visible=RENDERED, text_root=results_container),
+        condition(ERROR, ERROR_SELECTORS, ERROR_TEXTS, visible=RENDERED, text_root=PAGE_MESSAGE_ROOT),
+    ]
+
+# Funcao que classifica a pagina uma unica vez; retorna o estado ou None
+def classify_page(driver, conditions, root_selector=None):
+    try:
+        return driver.execute_script(_CLASSIFY_JS, conditions, root_selector)
+    except WebDriverException:
+        # Pagina ainda navegando / documento trocado: tenta de novo no proximo polling
+        return None
+
+# Funcao que espera ate alguma condicao aparecer; retorna o estado ou TIMEOUT
+def wait_for_page_state(driver, conditions, timeout, poll_frequency=0.25, root_selector=None):
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=poll_frequency).until(
+            lambda d: classify_page(d, conditions, root_selector)
+        )
+    except TimeoutException:
+        return TIMEOUT
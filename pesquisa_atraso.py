@@ -1,21 +1,34 @@
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import json
+import io
 import logging
-import os
 import time
 from playwright.sync_api import sync_playwright
+from PIL import Image
 import pytz
 import uuid
+from delay_analytics import DelayAnalytics
+from monitor_logging import setup_logging
 
-# Configure logging to a file for persistent debugging
-logging.basicConfig(
+# Configure logging: records are queued and written by a background thread as JSON lines,
+# rotated at 10 MB (set rotate_when="midnight" for daily rotation instead)
+log_file = 'flixbus_script.log'
+log_max_bytes = 10 * 1024 * 1024
+log_backup_count = 5
+log_rotate_when = None
+# Raw API responses/requests go to gzip archives here (None disables); keep 1 in N per category
+raw_archive_dir = None
+raw_sample_every = {"api_response": 1, "azure_request": 1}
+
+setup_logging(
+    log_file,
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('flixbus_script.log'),
-        logging.StreamHandler()
-    ]
+    max_bytes=log_max_bytes,
+    backup_count=log_backup_count,
+    rotate_when=log_rotate_when,
+    raw_archive_dir=raw_archive_dir,
+    sample_every=raw_sample_every
 )
 
 # Predefined station IDs
@@ -54,6 +67,19 @@ azure_headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
 }
 
+# Screenshot configuration: captured as JPEG in memory, clipped to the map region
+screenshot_jpeg_quality = 75
+screenshot_clip_selector = ".map-container"
+# Opt-in: downscale wider captures to this width with PIL (a second decode and lossy re-encode).
+# None sends the browser's JPEG as is; prefer a smaller viewport/clip to shrink captures.
+screenshot_max_width = None
+
+# Single background thread for the optional downscaling, so encoding overlaps the JSON request
+image_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="screenshot-encoder")
+
+# Rolling 24h delay statistics per line, business partner (LINES&BP.csv) and station
+analytics = DelayAnalytics(window_seconds=24 * 3600)
+
 # Track sent trips (trip_id, delay_minutes) and last reset date
 sent_trips = set()
 last_reset_date = datetime.now(pytz.timezone('America/Sao_Paulo')).date()
@@ -71,7 +97,7 @@ def reset_sent_trips():
 def format_time(timestamp_str, tz=pytz.timezone('America/Sao_Paulo')):
     """Convert timestamp to HH:MM in UTC-3, treating all inputs as UTC."""
     try:
-        logging.info(f"format_time input: {timestamp_str}")
+        logging.debug("format_time input: %s", timestamp_str)
         if timestamp_str.endswith('Z'):
             timestamp_str = timestamp_str[:-1] + '+00:00'
         else:
@@ -83,19 +109,15 @@ def format_time(timestamp_str, tz=pytz.timezone('America/Sao_Paulo')):
         dt = datetime.fromisoformat(timestamp_str)
         dt = dt.astimezone(tz)
         formatted_time = dt.strftime("%H:%M")
-        logging.info(f"Converted timestamp: {timestamp_str} -> {dt} ({formatted_time}) in {tz}")
+        logging.debug("Converted timestamp: %s -> %s (%s) in %s", timestamp_str, dt, formatted_time, tz)
         return formatted_time
     except ValueError as e:
         logging.error(f"Error parsing timestamp {timestamp_str}: {e}")
         return "Unknown"
 
-def take_screenshot(trip_id, output_path=None):
-    """Capture a screenshot of the FlixBus tracking page for the given trip_id."""
-    if output_path is None:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        output_path = os.path.join(script_dir, f"screenshot_{trip_id}.png")
-    
-    logging.info(f"Attempting to save screenshot to: {output_path}")
+def take_screenshot(trip_id, quality=screenshot_jpeg_quality, clip_selector=screenshot_clip_selector):
+    """Capture the FlixBus tracking page for the given trip_id as in-memory JPEG bytes, clipped to the map."""
+    logging.info(f"Capturing screenshot for trip {trip_id}")
     url = f"https://www.flixbus.com.br/track/ride/{trip_id}"
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
@@ -151,27 +173,45 @@ def take_screenshot(trip_id, output_path=None):
                 logging.warning("Warning: Page content seems empty.")
                 logging.warning(f"Page source snippet: {content[:500]}...")
             
-            page.screenshot(path=output_path, full_page=False)
-            logging.info(f"Screenshot saved to {output_path}")
+            clip = None
+            if clip_selector:
+                try:
+                    box = page.locator(clip_selector).first.bounding_box(timeout=1000)
+                except Exception as e:
+                    box = None
+                    logging.info(f"Could not locate {clip_selector} for clipping: {e}")
+                if box and box["width"] >= 1 and box["height"] >= 1:
+                    clip = {"x": box["x"], "y": box["y"], "width": box["width"], "height": box["height"]}
+                else:
+                    logging.info("Map region not measurable; capturing full viewport")
             
-            if os.path.exists(output_path):
-                file_size = os.path.getsize(output_path)
-                if file_size == 0:
-                    logging.error(f"Empty screenshot saved at {output_path}")
-                    raise ValueError("Empty screenshot detected")
-                logging.info(f"Screenshot file verified: {output_path}, Size: {file_size} bytes")
-            else:
-                logging.error(f"Screenshot file not found at {output_path}")
-                raise FileNotFoundError(f"Screenshot file not found at {output_path}")
+            image_bytes = page.screenshot(type="jpeg", quality=quality, clip=clip, full_page=False)
+            if not image_bytes:
+                logging.error(f"Empty screenshot captured for trip {trip_id}")
+                raise ValueError("Empty screenshot detected")
+            logging.info(f"Screenshot captured in memory for trip {trip_id}, Size: {len(image_bytes)} bytes")
             
         except Exception as e:
             logging.error(f"Error during screenshot process for trip {trip_id}: {e}")
             raise
         finally:
             browser.close()
-    return output_path
+    return image_bytes
 
-from PIL import Image  # Add this import at the top of your script
+def downscale_jpeg(image_bytes, max_width=screenshot_max_width, quality=screenshot_jpeg_quality):
+    """Shrink JPEG bytes to max_width, returning the input unchanged if it is already small enough."""
+    if not max_width:
+        return image_bytes
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        if img.width <= max_width:
+            return image_bytes
+        size = (max_width, round(img.height * max_width / img.width))
+        # draft() lets the JPEG decoder scale down by a power of two before the resize
+        img.draft("RGB", size)
+        output = io.BytesIO()
+        img.convert("RGB").resize(size, Image.LANCZOS).save(output, "JPEG", quality=quality, optimize=True)
+    logging.info(f"Downscaled screenshot to {size[0]}x{size[1]}: {len(image_bytes)} -> {output.tell()} bytes")
+    return output.getvalue()
 
 def send_to_azure_logic_apps(trip):
     """Send trip data as JSON to azure_endpoint and screenshot URL to azure_endpoint_screenshot."""
@@ -183,31 +223,15 @@ def send_to_azure_logic_apps(trip):
         logging.info(f"Skipping duplicate send for trip_id {trip_id} with delay {delay_minutes} minutes")
         return
 
-    # Take a screenshot of the tracking page
-    screenshot_filepath = None
+    # Take a screenshot of the tracking page (JPEG bytes, never written to disk)
     try:
-        screenshot_filepath = take_screenshot(trip_id)
+        captured_bytes = take_screenshot(trip_id)
     except Exception as e:
         logging.error(f"Failed to capture screenshot for trip {trip_id}: {e}")
         return
 
-    # Resize and convert screenshot to JPEG
-    jpeg_filepath = None
-    if screenshot_filepath and os.path.exists(screenshot_filepath):
-        try:
-            with Image.open(screenshot_filepath) as img:
-                # Convert to JPEG
-                jpeg_filepath = screenshot_filepath.rsplit('.', 1)[0] + '.jpg'
-                img.convert('RGB').save(jpeg_filepath, 'JPEG', quality=85)
-                logging.info(f"Converted and resized screenshot to {jpeg_filepath}")
-            # Remove original screenshot file
-            os.remove(screenshot_filepath)
-            logging.info(f"Deleted original screenshot: {screenshot_filepath}")
-            screenshot_filepath = jpeg_filepath
-        except Exception as e:
-            logging.error(f"Error resizing/converting screenshot for trip {trip_id}: {e}")
-            # Proceed with original screenshot if conversion fails
-            jpeg_filepath = None
+    # Optional downscale, off-thread while the JSON payload is being sent
+    downscale_future = image_executor.submit(downscale_jpeg, captured_bytes) if screenshot_max_width else None
 
     # Prepare JSON payload for metadata
     json_payload = {
@@ -224,17 +248,16 @@ def send_to_azure_logic_apps(trip):
 
     # Send JSON payload to azure_endpoint
     try:
-        logging.info(f"Sending JSON data to {azure_endpoint}: {json.dumps(json_payload, indent=2)}")
-        logging.info(f"JSON request headers: {azure_headers}")
+        logging.info(f"Sending JSON data for trip_id {trip_id} to Azure Logic Apps", extra={"category": "azure_request", "payload": json_payload})
+        logging.debug("JSON request headers: %s", azure_headers)
         response = requests.post(
             azure_endpoint,
             headers={"Content-Type": "application/json", "User-Agent": azure_headers["User-Agent"]},
             json=json_payload
         )
         response.raise_for_status()
-        logging.info(f"JSON request sent to Azure Logic Apps: {json.dumps(json_payload, indent=2)}")
-        logging.info(f"JSON response Status: {response.status_code}")
-        logging.info(f"JSON response Content: {response.text}")
+        logging.info(f"JSON request sent to Azure Logic Apps, Status: {response.status_code}")
+        logging.debug("JSON response Content: %s", response.text)
     except requests.RequestException as e:
         logging.error(f"Error sending JSON to Azure Logic Apps: {e}")
         if hasattr(e, 'response') and e.response is not None:
@@ -242,35 +265,43 @@ def send_to_azure_logic_apps(trip):
             logging.error(f"JSON response headers: {e.response.headers}")
         logging.info("Proceeding to attempt screenshot upload despite JSON failure")
 
+    screenshot_bytes = captured_bytes
+    if downscale_future is not None:
+        try:
+            screenshot_bytes = downscale_future.result()
+        except Exception as e:
+            # Proceed with the captured JPEG if downscaling fails
+            logging.error(f"Error downscaling screenshot for trip {trip_id}: {e}")
+
     # Upload screenshot to Filebin.net and send URL to azure_endpoint_screenshot
-    if screenshot_filepath and os.path.exists(screenshot_filepath):
+    if screenshot_bytes:
         upload_success = False
         download_url = None
+        filename = f"screenshot_{trip_id}.jpg"
 
         try:
-            with open(screenshot_filepath, "rb") as file_handle:
-                bin_id = str(uuid.uuid4())[:8]  # Random bin ID
-                filename = os.path.basename(screenshot_filepath)
-                url = f"https://filebin.net/{bin_id}/{filename}"
-                headers = {
-                    "cid": str(uuid.uuid4())[:8],  # Optional custom client ID
-                    "Content-Disposition": f'attachment; filename="{filename}"'
-                }
-                logging.info(f"Uploading screenshot to Filebin.net for trip_id {trip_id}: {url}")
-                response = requests.put(
-                    url,
-                    data=file_handle,
-                    headers=headers,
-                    timeout=30
-                )
-                response.raise_for_status()
-                upload_response = response.json()
-                download_url = upload_response.get("url", url)  # Use the request URL as fallback if no redirect
-                if download_url:
-                    upload_success = True
-                    logging.info(f"Screenshot uploaded to Filebin.net, URL: {download_url}")
-                else:
-                    logging.warning("Filebin.net returned no URL in response")
+            bin_id = str(uuid.uuid4())[:8]  # Random bin ID
+            url = f"https://filebin.net/{bin_id}/{filename}"
+            headers = {
+                "cid": str(uuid.uuid4())[:8],  # Optional custom client ID
+                "Content-Type": "image/jpeg",
+                "Content-Disposition": f'attachment; filename="{filename}"'
+            }
+            logging.info(f"Uploading screenshot to Filebin.net for trip_id {trip_id}: {url} ({len(screenshot_bytes)} bytes)")
+            response = requests.put(
+                url,
+                data=screenshot_bytes,
+                headers=headers,
+                timeout=30
+            )
+            response.raise_for_status()
+            upload_response = response.json()
+            download_url = upload_response.get("url", url)  # Use the request URL as fallback if no redirect
+            if download_url:
+                upload_success = True
+                logging.info(f"Screenshot uploaded to Filebin.net, URL: {download_url}")
+            else:
+                logging.warning("Filebin.net returned no URL in response")
         except Exception as e:
             logging.error(f"Error uploading to Filebin.net: {e}")
             if hasattr(e, 'response') and e.response is not None:
@@ -281,34 +312,23 @@ def send_to_azure_logic_apps(trip):
             try:
                 payload = {
                     "screenshot_url": download_url,
-                    "file_name": f"screenshot_{trip_id}.jpg"  # Updated to .jpg
+                    "file_name": filename
                 }
-                logging.info(f"Sending URL to {azure_endpoint_screenshot}: {json.dumps(payload, indent=2)}")
+                logging.info(f"Sending screenshot URL for trip_id {trip_id} to Azure Logic Apps", extra={"category": "azure_request", "payload": payload})
                 response = requests.post(
                     azure_endpoint_screenshot,
                     headers={"Content-Type": "application/json", "User-Agent": azure_headers["User-Agent"]},
                     json=payload
                 )
                 response.raise_for_status()
-                logging.info(f"URL request sent to Azure Logic Apps: {json.dumps(payload, indent=2)}")
-                logging.info(f"URL response Status: {response.status_code}")
-                logging.info(f"URL response Content: {response.text}")
+                logging.info(f"URL request sent to Azure Logic Apps, Status: {response.status_code}")
+                logging.debug("URL response Content: %s", response.text)
                 sent_trips.add(trip_id)
             except Exception as e:
                 logging.error(f"Error sending URL to Azure Logic Apps: {e}")
                 if hasattr(e, 'response') and e.response is not None:
                     logging.error(f"URL response content: {e.response.text}")
 
-        # Clean up screenshot file
-        if screenshot_filepath and os.path.exists(screenshot_filepath):
-            try:
-                with open(screenshot_filepath, "rb") as f:
-                    pass  # Force close any lingering handle
-                os.remove(screenshot_filepath)
-                logging.info(f"Deleted temporary file: {screenshot_filepath}")
-            except OSError as e:
-                logging.error(f"Error deleting file {screenshot_filepath}: {e}")
-
 def check_delays():
     """Check for delayed departures for all lines where the station is the first stop (partida)."""
     reset_sent_trips()
@@ -329,15 +349,21 @@ def check_delays():
             response = requests.get(url, headers=flixbus_headers, timeout=10)
             response.raise_for_status()
             data = response.json()
-            logging.info(f"API response for {city}: {json.dumps(data, indent=2)}")
+            # Only the ride count is logged; the full response goes to the raw archive if enabled
+            logging.info(f"API response for {city}: {len(data.get('rides', []))} rides", extra={"category": "api_response", "payload": data})
         except requests.RequestException as e:
             logging.error(f"Error accessing FlixBus API for {city}: {e}")
             continue
 
+        polled_at = time.time()
         for trip in data.get('rides', []):
+            # Feed every departure (on time or late) starting at this station into the analytics
+            if any(call.get('sequence') == 1 and (call.get('stop') or {}).get('id') == station_id for call in trip.get('calls') or []):
+                analytics.record(trip, city, polled_at)
+
             trip_id = trip.get('id', 'Unknown')
             if trip_id in seen_trip_ids:
-                logging.info(f"Skipping duplicate trip ID {trip_id} in this run")
+                logging.debug("Skipping duplicate trip ID %s in this run", trip_id)
                 continue
             seen_trip_ids.add(trip_id)
             deviation = trip.get('status', {}).get('deviation', {})
@@ -348,7 +374,7 @@ def check_delays():
                     for call in calls
                 )
                 if not is_partida:
-                    logging.info(f"Skipping trip ID {trip_id} with line {trip.get('line', {}).get('code', 'Unknown')} as it is not a partida from {city}")
+                    logging.debug("Skipping trip ID %s with line %s as it is not a partida from %s", trip_id, trip.get('line', {}).get('code', 'Unknown'), city)
                     continue
                 final_destination = calls[-1].get('stop', {}).get('name', 'Unknown') if calls else "Unknown"
                 scheduled_time = trip.get('status', {}).get('scheduled_timestamp', 'Unknown')
@@ -356,7 +382,7 @@ def check_delays():
                 delay_seconds = deviation.get('deviation_seconds', 0)
                 line_code = trip.get('line', {}).get('code', 'Unknown')
 
-                logging.info(f"Trip ID {trip_id}: Raw scheduled_time={scheduled_time}, Raw actual_time={actual_time}")
+                logging.debug("Trip ID %s: Raw scheduled_time=%s, Raw actual_time=%s", trip_id, scheduled_time, actual_time)
 
                 delayed_trips.append({
                     'city': city,
@@ -383,6 +409,21 @@ def check_delays():
         logging.info("No delayed departures found.")
         print("\nNo delayed departures found.")
 
+    print_partner_summary()
+
+def print_partner_summary():
+    """Print the rolling delay statistics per business partner."""
+    analytics.expire()
+    summary = analytics.summary("partner")
+    if not summary:
+        return
+    print("\n=== Delay Statistics per Partner (last 24h) ===")
+    print(f"{'Partner':<20} {'Rides':<8} {'p50 (min)':<10} {'p95 (min)':<10} {'On time':<8}")
+    print("-" * 60)
+    for partner, stats in sorted(summary.items()):
+        print(f"{partner:<20} {stats['count']:<8} {stats['p50_delay_minutes']:<10} {stats['p95_delay_minutes']:<10} {stats['on_time_ratio']:<8.0%}")
+    print("====================")
+
 # Main execution
 if __name__ == "__main__":
     try:
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+# Fila de tasks persistida em SQLite para distribuir o crawler entre varias maquinas.
+# O coordenador publica as tasks (origem, destino, data) e os workers alugam uma task
+# por vez com timeout de visibilidade, mandam heartbeat enquanto processam e devolvem
+# as linhas coletadas para a tabela de resultados (sink central).
+#
+# Apenas UM host abre o arquivo .db: ele precisa estar em um filesystem local com
+# locks POSIX funcionando (NFS/SMB nao servem). Workers em outras maquinas falam com
+# esse host pelo servidor HTTP deste modulo (serve / HttpQueue); workers no mesmo
+# host podem usar o arquivo direto (SqliteQueue). O servidor escuta so em 127.0.0.1 por
+# padrao; para aceitar outros nos e obrigatorio um token compartilhado (header X-Queue-Token).
+import hmac
+import json
+import sqlite3
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+TOKEN_HEADER = "X-Queue-Token"
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    origem TEXT NOT NULL,
+    destino TEXT NOT NULL,
+    date TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    outcome TEXT,
+    UNIQUE (origem, destino, date)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, lease_until);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id INTEGER NOT NULL REFERENCES tasks (id),
+    worker TEXT NOT NULL,
+    row_json TEXT NOT NULL
+);
+"""
+
+# Funcao para abrir a conexao (uma por processo/thread) e garantir o schema
+def connect(db_path):
+    # isolation_level=None: controlamos as transacoes manualmente com BEGIN IMMEDIATE
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    # Journal classico (nao WAL): WAL depende de memoria compartilhada (-shm) de um unico host
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.execute("PRAGMA busy_timeout=60000")
+    conn.executescript(_SCHEMA)
+    return conn
+
+# Funcao para publicar tasks na fila (tasks repetidas sao ignoradas)
+def publish_tasks(db_path, tasks):
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        before = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        conn.executemany(
+            "INSERT OR IGNORE INTO tasks (origem, destino, date) VALUES (?, ?, ?)",
+            tasks
+        )
+        after = conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        conn.execute("COMMIT")
+        return after - before
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+# Funcao para alugar a proxima task livre (pendente ou com lease expirado)
+def lease_task(conn, worker_id, visibility_timeout, max_attempts=3):
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Tasks cujo lease expirou e ja estouraram as tentativas sao marcadas como falha
+        conn.execute(
+            "UPDATE tasks SET status = ?, error = 'lease expirado' "
+            "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (FAILED, LEASED, now, max_attempts)
+        )
+        row = conn.execute(
+            "SELECT id, origem, destino, date FROM tasks "
+            "WHERE status = ? OR (status = ? AND lease_until < ?) "
+            "ORDER BY id LIMIT 1",
+            (PENDING, LEASED, now)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+            (LEASED, worker_id, now + visibility_timeout, row[0])
+        )
+        conn.execute("COMMIT")
+        return row
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+# Funcao para estender o lease; retorna False se a task nao pertence mais a este worker
+def heartbeat(conn, task_id, worker_id, visibility_timeout):
+    cursor = conn.execute(
+        "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+        (time.time() + visibility_timeout, task_id, worker_id, LEASED)
+    )
+    return cursor.rowcount == 1
+
+# Funcao para gravar as linhas coletadas e concluir a task na mesma transacao
+# (outcome: estado da pagina observado pelo worker, ex.: resultados, sem_viagens, bloqueado)
+def complete_task(conn, task_id, worker_id, rows, outcome=None):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = conn.execute(
+            "UPDATE tasks SET status = ?, lease_until = NULL, outcome = ? WHERE id = ? AND worker = ? AND status = ?",
+            (DONE, outcome, task_id, worker_id, LEASED)
+        )
+        if cursor.rowcount != 1:
+            # O lease expirou e outro worker pegou a task: descarta para nao duplicar linhas
+            conn.execute("ROLLBACK")
+            return False
+        conn.executemany(
+            "INSERT INTO results (task_id, worker, row_json) VALUES (?, ?, ?)",
+            [(task_id, worker_id, json.dumps(row, ensure_ascii=False)) for row in rows]
+        )
+        conn.execute("COMMIT")
+        return True
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+# Funcao para devolver a task com erro (volta para a fila ate estourar as tentativas);
+# o outcome da tentativa (ex.: bloqueado, timeout) fica gravado mesmo sem concluir
+def fail_task(conn, task_id, worker_id, error, max_attempts=3, outcome=None):
+    conn.execute(
+        "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+        "lease_until = NULL, error = ?, outcome = ? WHERE id = ? AND worker = ? AND status = ?",
+        (max_attempts, FAILED, PENDING, str(error)[:500], outcome, task_id, worker_id, LEASED)
+    )
+
+# Funcao para contar tasks por status
+def queue_status(conn):
+    counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+    for status, count in conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"):
+        counts[status] = count
+    return counts
+
+# Funcao para contar as tasks por status e ultimo estado de pagina observado ({status: {outcome: n}})
+def outcome_counts(conn):
+    counts = {}
+    for status, outcome, count in conn.execute(
+        "SELECT status, outcome, COUNT(*) FROM tasks WHERE outcome IS NOT NULL GROUP BY status, outcome"
+    ):
+        counts.setdefault(status, {})[outcome] = count
+    return counts
+
+# Funcao para ler todas as linhas do sink central
+def fetch_results(db_path):
+    conn = connect(db_path)
+    try:
+        return [json.loads(row_json) for (row_json,) in conn.execute("SELECT row_json FROM results ORDER BY id")]
+    finally:
+        conn.close()
+
+# Acesso direto ao arquivo .db (somente no host onde o arquivo esta)
+class SqliteQueue:
+    def __init__(self, db_path):
+        self.conn = connect(db_path)
+
+    def lease(self, worker_id, visibility_timeout, max_attempts):
+        return lease_task(self.conn, worker_id, visibility_timeout, max_attempts)
+
+    def heartbeat(self, task_id, worker_id, visibility_timeout):
+        return heartbeat(self.conn, task_id, worker_id, visibility_timeout)
+
+    def complete(self, task_id, worker_id, rows, outcome=None):
+        return complete_task(self.conn, task_id, worker_id, rows, outcome)
+
+    def fail(self, task_id, worker_id, error, max_attempts, outcome=None):
+        fail_task(self.conn, task_id, worker_id, error, max_attempts, outcome)
+
+    def status(self):
+        return queue_status(self.conn)
+
+    def report(self):
+        return {"status": queue_status(self.conn), "outcomes": outcome_counts(self.conn)}
+
+    def close(self):
+        self.conn.close()
+
+# Acesso remoto pelo servidor HTTP do coordenador (mesma interface da SqliteQueue)
+class HttpQueue:
+    def __init__(self, base_url, token=None, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _call(self, path, payload=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def lease(self, worker_id, visibility_timeout, max_attempts):
+        task = self._call("/lease", {"worker_id": worker_id, "visibility_timeout": visibility_timeout, "max_attempts": max_attempts})["task"]
+        return tuple(task) if task else None
+
+    def heartbeat(self, task_id, worker_id, visibility_timeout):
+        return self._call("/heartbeat", {"task_id": task_id, "worker_id": worker_id, "visibility_timeout": visibility_timeout})["ok"]
+
+    def complete(self, task_id, worker_id, rows, outcome=None):
+        return self._call("/complete", {"task_id": task_id, "worker_id": worker_id, "rows": rows, "outcome": outcome})["ok"]
+
+    def fail(self, task_id, worker_id, error, max_attempts, outcome=None):
+        self._call("/fail", {"task_id": task_id, "worker_id": worker_id, "error": str(error),
+                             "max_attempts": max_attempts, "outcome": outcome})
+
+    def status(self):
+        return self._call("/status")["status"]
+
+    def report(self):
+        return self._call("/status")
+
+    def close(self):
+        pass
+
+# Funcao para abrir a fila a partir de um caminho .db ou de uma URL http(s)://host:porta do coordenador
+def open_queue(target, token=None):
+    if target.startswith(("http://", "https://")):
+        return HttpQueue(target, token)
+    return SqliteQueue(target)
+
+# Funcao que sobe o servidor HTTP do coordenador; e o unico processo que abre o arquivo .db.
+# As requisicoes sao atendidas uma por vez, entao uma unica conexao basta.
+# Fora de 127.0.0.1 o token e obrigatorio: sem ele qualquer um na rede poderia alugar,
+# falhar tasks ou inserir linhas no sink central.
+def serve(db_path, host="127.0.0.1", port=8765, token=None):
+    if host not in LOOPBACK_HOSTS and not token:
+        raise ValueError(f"Token obrigatorio para expor a fila em {host}")
+    conn = connect(db_path)
+
+    def _handle(path, body):
+        if path == "/lease":
+            return {"task": lease_task(conn, body["worker_id"], body["visibility_timeout"], body["max_attempts"])}
+        if path == "/heartbeat":
+            return {"ok": heartbeat(conn, body["task_id"], body["worker_id"], body["visibility_timeout"])}
+        if path == "/complete":
+            return {"ok": complete_task(conn, body["task_id"], body["worker_id"], body["rows"], body.get("outcome"))}
+        if path == "/fail":
+            fail_task(conn, body["task_id"], body["worker_id"], body["error"], body["max_attempts"], body.get("outcome"))
+            return {"ok": True}
+        if path == "/status":
+            return {"status": queue_status(conn), "outcomes": outcome_counts(conn)}
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self, body):
+            if token and not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), token):
+                self.send_error(401)
+                return
+            try:
+                result = _handle(self.path, body)
+            except Exception as e:
+                print(f"Erro no coordenador ({self.path}): {e}")
+                self.send_error(500, str(e))
+                return
+            if result is None:
+                self.send_error(404)
+                return
+            data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._respond({})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self._respond(json.loads(self.rfile.read(length).decode("utf-8")) if length else {})
+
+        def log_message(self, format, *args):
+            pass  # Sem log por requisicao (heartbeats sao frequentes)
+
+    server = HTTPServer((host, port), Handler)
+    print(f"Coordenador da fila {db_path} ouvindo em http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        conn.close()
+
+# Funcao que roda o heartbeat em uma thread separada enquanto a task e processada.
+# target: caminho do .db ou URL do coordenador. Retorna o Event que deve ser setado para parar a thread.
+def start_heartbeat(target, task_id, worker_id, visibility_timeout, token=None):
+    stop = threading.Event()
+
+    def _beat():
+        task_q = open_queue(target, token)
+        try:
+            # Renova o lease a cada 1/3 do timeout para tolerar atrasos pontuais
+            while not stop.wait(visibility_timeout / 3):
+                try:
+                    if not task_q.heartbeat(task_id, worker_id, visibility_timeout):
+                        print(f"Lease da task {task_id} perdido pelo worker {worker_id}.")
+                        break
+                except Exception as e:
+                    print(f"Erro no heartbeat da task {task_id}: {e}")
+        finally:
+            task_q.close()
+
+    thread = threading.Thread(target=_beat, daemon=True)
+    thread.start()
+    return stop